@@ -1,4 +1,6 @@
+import collections
 import ftplib
+import functools
 from ftplib import all_errors
 import ssl
 import os
@@ -8,12 +10,50 @@ from tqdm import tqdm
 import argparse
 import time
 import subprocess
-from telegram import Bot
-from telegram.error import TelegramError
+from telegram import Bot, InputFile
+from telegram.request import HTTPXRequest
+from telegram.error import NetworkError, RetryAfter, TelegramError
 import asyncio
+import queue
 import re
 import shutil
+import socket
+import sqlite3
+import struct
 import sys
+import threading
+
+from _listing import parse_ftp_listing, get_base_name
+
+# Optional: PyNvVideoCodec drives NVDEC/NVENC directly and saturates the
+# accelerators far better than ffmpeg's cuda path. Fall back to ffmpeg if the
+# wheel is not installed.
+try:
+    import PyNvVideoCodec as nvc
+except ImportError:
+    nvc = None
+
+# Optional: aioftp lets --all runs open several data connections in parallel.
+# Downloads fall back to the serial control connection if it is missing.
+try:
+    import aioftp
+except ImportError:
+    aioftp = None
+
+# Optional: orjson decodes JSON several times faster than the stdlib module.
+# The stdlib json is kept as the fallback.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: Telethon uploads over MTProto straight to Telegram's data center
+# in 512KB parts, which is noticeably faster than the Bot HTTP API for large
+# videos. Needs telegram_api_id/telegram_api_hash in config.json.
+try:
+    from telethon import TelegramClient
+except ImportError:
+    TelegramClient = None
 
 def check_ffmpeg_dependencies():
     """Check if ffmpeg and ffprobe are available in the system PATH."""
@@ -32,13 +72,48 @@ def check_ffmpeg_dependencies():
     print(f"Dependencies found:\n- ffmpeg: {ffmpeg_path}\n- ffprobe: {ffprobe_path}")
 
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
-with open(CONFIG_PATH, 'r') as f:
-    config = json.load(f)
+if orjson is not None:
+    with open(CONFIG_PATH, 'rb') as f:
+        config = orjson.loads(f.read())
+else:
+    with open(CONFIG_PATH, 'r') as f:
+        config = json.load(f)
 PRINTER_IP = config.get('printer_ip')
 ACCESS_CODE = config.get('access_code')
 
+# One Bot for the whole process: keeps python-telegram-bot's HTTPX connection
+# pool (and its TLS session to api.telegram.org) warm across uploads. Generous
+# read/write timeouts stop httpx from giving up mid-way through a ~49MB video.
+_TG_BOT = Bot(
+    token=config['telegram_bot_token'],
+    request=HTTPXRequest(connect_timeout=60, read_timeout=600, write_timeout=600),
+) if config.get('telegram_bot_token') else None
+
+# Telegram allows roughly 20 messages per minute per channel; remember the
+# last 20 send times so uploads can wait out the window instead of tripping
+# a RetryAfter mid-run.
+_TG_SEND_TIMES = collections.deque(maxlen=20)
+
+# Serialize uploads so concurrent senders can never trigger a hard flood
+# ban between them; the retry loop below then only has to handle its own
+# RetryAfter responses.
+_TG_UPLOAD_LOCK = asyncio.Lock()
+
+def detect_nvenc():
+    """Probe ffmpeg's encoder list once at startup for hevc_nvenc.
+
+    Saves a failed ffmpeg launch per file on hosts without NVENC and lets
+    codec selection happen automatically instead of via --no-gpu."""
+    try:
+        enc_out = subprocess.check_output(['ffmpeg', '-hide_banner', '-encoders'],
+                                          text=True, stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, OSError):
+        return False
+    return 'hevc_nvenc' in enc_out
+
 # Check FFmpeg dependencies on script launch
 check_ffmpeg_dependencies()
+HAVE_NVENC = detect_nvenc()
 
 class ImplicitFTP_TLS(ftplib.FTP_TLS):
     """FTP_TLS subclass that automatically wraps sockets in SSL to support implicit FTPS."""
@@ -58,28 +133,107 @@ class ImplicitFTP_TLS(ftplib.FTP_TLS):
             value = self.context.wrap_socket(value)
         self._sock = value
 
-def parse_ftp_listing(line):
-    """Parse a line from an FTP LIST command."""
-    parts = line.split(maxsplit=8)
-    if len(parts) < 9:
-        return None
-    return {
-        'permissions': parts[0],
-        'links': int(parts[1]),
-        'owner': parts[2],
-        'group': parts[3],
-        'size': int(parts[4]),
-        'month': parts[5],
-        'day': int(parts[6]),
-        'time_or_year': parts[7],
-        'name': parts[8]
-    }
+class FTPSession:
+    """Persistent FTPS session that can be reused across watch-mode iterations.
 
-def get_base_name(filename):
-    return filename.rsplit('.', 1)[0]
+    Keeps a single ImplicitFTP_TLS connection alive with a NOOP keepalive so
+    each poll skips the TCP+TLS handshake, LOGIN and PROT P round trips."""
+    def __init__(self, host, user, password):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.ftp = None
+        self.last_used = 0.0
+
+    def _connect(self):
+        ftp = ImplicitFTP_TLS()
+        ftp.set_pasv(True)
+        print('Connecting...')
+        ftp.connect(host=self.host, port=990, timeout=15, source_address=None)
+        ftp.login(self.user, self.password)
+        ftp.prot_p()
+        self.ftp = ftp
+        self.last_used = time.time()
+        return ftp
+
+    def get(self):
+        """Return a live connection, reconnecting if the old one went stale."""
+        if self.ftp is None:
+            return self._connect()
+        if time.time() - self.last_used > 30:
+            try:
+                self.ftp.voidcmd('NOOP')
+            except all_errors:
+                print('FTP connection went stale, reconnecting...')
+                self.close()
+                return self._connect()
+        self.last_used = time.time()
+        return self.ftp
+
+    def close(self):
+        if self.ftp is None:
+            return
+        try:
+            if self.ftp.sock:
+                self.ftp.quit()
+        except all_errors:
+            pass
+        except Exception:
+            pass
+        try:
+            self.ftp.close()
+        except Exception:
+            pass
+        self.ftp = None
+
+def list_directory(ftp, path):
+    """List a remote directory, preferring MLSD's machine-readable facts.
+
+    One MLSD on the full path replaces the CWD+LIST pair (two control-channel
+    round trips instead of four per poll). Entries are shaped like
+    parse_ftp_listing's dicts, plus a 'modify' fact (YYYYMMDDHHMMSS) that
+    gives an exact timestamp with no year guessing."""
+    try:
+        entries = []
+        for name, facts in ftp.mlsd(path, facts=['type', 'size', 'modify']):
+            if facts.get('type') not in (None, 'file'):
+                continue
+            entries.append({
+                'name': name,
+                'size': int(facts.get('size', 0)),
+                'modify': facts.get('modify'),
+            })
+        return entries
+    except all_errors:
+        # Firmware without MLSD support: fall back to a plain LIST.
+        lines = []
+        ftp.cwd(path)
+        ftp.retrlines('LIST', lines.append)
+        return [p for p in map(parse_ftp_listing, lines) if p is not None]
+
+async def fetch_one(item, out_dir, sem, total_pbar=None):
+    """Download a single timelapse over its own implicit-TLS connection.
+
+    Used by --all runs to keep several FTP data channels in flight at once;
+    the semaphore bounds how many transfers run concurrently."""
+    local_filename = os.path.join(out_dir, item["name"])
+    ssl_ctx = ssl._create_unverified_context()
+    async with sem:
+        async with aioftp.Client.context(PRINTER_IP, 990, user='bblp',
+                                         password=ACCESS_CODE, ssl=ssl_ctx) as client:
+            await client.download(f'/timelapse/{item["name"]}', local_filename, write_into=True)
+    if total_pbar:
+        total_pbar.update(item["size"])
+    return True
 
 def parse_date(item):
     """Parse the date and time from the FTP listing item."""
+    modify = item.get('modify')
+    if modify:
+        try:
+            return datetime.strptime(modify[:14], "%Y%m%d%H%M%S")
+        except ValueError:
+            pass
     try:
         # Use the current year as default to avoid deprecation warning
         current_year = datetime.now().year
@@ -93,34 +247,368 @@ def parse_date(item):
             parsed_date = datetime.strptime(f"{current_year - 1} {date_str}", "%Y %b %d %H:%M")
         
         return parsed_date
-    except ValueError:
+    except (KeyError, ValueError):
         return None
 
+# Matches video_YYYY-MM-DD_HH-MM-SS.* (compiled once; hit per file in watch mode)
+_TS_RE = re.compile(r'video_(\d{4}-\d{2}-\d{2})_(\d{2}-\d{2}-\d{2})')
+
 def extract_datetime_from_filename(filename):
-    # Matches video_YYYY-MM-DD_HH-MM-SS.*
-    m = re.search(r'video_(\d{4}-\d{2}-\d{2})_(\d{2}-\d{2}-\d{2})', filename)
+    m = _TS_RE.search(filename)
     if m:
         date_str = m.group(1)
         time_str = m.group(2).replace('-', ':')
         return f"Timelapse: {date_str} {time_str}"
     return "Timelapse"
 
-# Utility function to get video duration using ffprobe
-def get_video_duration(filename):
+def nvenc_tune(preset):
+    """NVENC tuning to pair with a preset: hq for the slow presets, low
+    latency for the fast ones."""
+    return 'hq' if preset in ('p6', 'p7') else 'll'
+
+# Key=value lines emitted by ffmpeg's -progress writer; everything else on
+# stderr is real log output worth keeping for error reports.
+_FFMPEG_PROGRESS_KEYS = ('frame=', 'fps=', 'stream_', 'bitrate=', 'total_size=',
+                         'out_time', 'dup_frames=', 'drop_frames=', 'speed=',
+                         'progress=')
+
+def run_ffmpeg(cmd, duration=None):
+    """Run an ffmpeg command with a tqdm progress bar.
+
+    Appends -progress pipe:2 -nostats and parses the out_time_us lines
+    ffmpeg emits on stderr, so long transcodes show progress and a
+    KeyboardInterrupt terminates ffmpeg instead of orphaning it. The last
+    non-progress stderr lines are kept so a failure still shows ffmpeg's
+    own error text; raises CalledProcessError (with that text attached)
+    so existing handlers keep working."""
+    proc = subprocess.Popen(cmd + ['-progress', 'pipe:2', '-nostats'],
+                            stderr=subprocess.PIPE, text=True)
+    total = int(duration * 1_000_000) if duration else None
+    log_tail = collections.deque(maxlen=30)
+    try:
+        with tqdm(total=total, unit='s', unit_scale=1e-6,
+                  desc=f'Encoding {os.path.basename(cmd[-1])}') as pbar:
+            for line in proc.stderr:
+                if line.startswith('out_time_us='):
+                    try:
+                        done = int(line.strip().split('=', 1)[1])
+                    except ValueError:
+                        continue
+                    if total:
+                        pbar.n = min(done, total)
+                        pbar.refresh()
+                elif not line.startswith(_FFMPEG_PROGRESS_KEYS):
+                    log_tail.append(line.rstrip())
+        proc.wait()
+    except KeyboardInterrupt:
+        proc.terminate()
+        proc.wait()
+        raise
+    if proc.returncode != 0:
+        stderr_tail = '\n'.join(log_tail)
+        if stderr_tail:
+            print(stderr_tail)
+        raise subprocess.CalledProcessError(proc.returncode, cmd,
+                                            stderr=stderr_tail)
+
+def transcode_nvc(local_filename, streamable_filename, target_fps, original_fps, preset='p5', bitrate=5_000_000):
+    """Transcode using PyNvVideoCodec: decode on NVDEC, drop frames on the GPU,
+    encode on NVENC. Returns True on success, False so the caller can fall back
+    to the ffmpeg command line."""
+    if nvc is None:
+        return False
+    stride = max(1, int(round(original_fps / target_fps)))
+    raw_bitstream = streamable_filename + '.hevc'
+    try:
+        demuxer = nvc.CreateDemuxer(filename=local_filename)
+        decoder = nvc.CreateDecoder(gpuid=0, codec=demuxer.GetNvCodecId(),
+                                    cudacontext=0, cudastream=0, usedevicememory=True)
+        tuning = 'high_quality' if preset in ('p6', 'p7') else 'low_latency'
+        encoder = nvc.CreateEncoder(demuxer.Width(), demuxer.Height(), 'NV12', False,
+                                    codec='hevc', preset=preset.upper(), tuning_info=tuning,
+                                    bitrate=bitrate)
+        frame_idx = 0
+        with open(raw_bitstream, 'wb') as out:
+            for packet in demuxer:
+                for frame in decoder.Decode(packet):
+                    if frame_idx % stride == 0:
+                        bitstream = encoder.Encode(frame)
+                        if bitstream:
+                            out.write(bytearray(bitstream))
+                    frame_idx += 1
+            bitstream = encoder.EndEncode()
+            if bitstream:
+                out.write(bytearray(bitstream))
+        # Single remux pass to wrap the raw HEVC bitstream into a streamable mp4.
+        subprocess.run([
+            'ffmpeg', '-y', '-r', f'{target_fps}', '-i', raw_bitstream,
+            '-c', 'copy', '-tag:v', 'hvc1', '-video_track_timescale', '90000', '-movflags', '+faststart',
+            streamable_filename
+        ], check=True)
+        return True
+    except Exception as e:
+        print(f'PyNvVideoCodec transcode failed ({e}); falling back to ffmpeg')
+        return False
+    finally:
+        if os.path.exists(raw_bitstream):
+            os.remove(raw_bitstream)
+
+@functools.lru_cache(maxsize=128)
+def _probe_cached(filename, mtime_ns, size):
+    result = subprocess.run([
+        'ffprobe', '-v', 'error', '-threads', '0',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=r_frame_rate,codec_name,width,height:format=duration',
+        '-of', 'json', filename
+    ], capture_output=True, text=True)
+    info = json.loads(result.stdout)
+    stream = info['streams'][0]
+    num, _, den = stream['r_frame_rate'].partition('/')
+    return {
+        'duration': float(info['format']['duration']),
+        'fps': float(num) / float(den or 1),
+        'width': stream.get('width'),
+        'height': stream.get('height'),
+        'codec': stream.get('codec_name'),
+    }
+
+def drain_transfer_reply(ftp):
+    """Consume the pending 226/426 reply after a failed transfer.
+
+    A RETR whose data phase blew up still owes a reply on the control
+    channel; leaving it unread desyncs every later command on the shared
+    connection (and the stale 226 would even satisfy FTPSession's NOOP
+    liveness check). Bounded by a short timeout so a dead server cannot
+    hang us; if draining fails the connection is truly broken and the
+    next FTPSession.get() will reconnect."""
+    if ftp.sock is None:
+        return
+    old_timeout = ftp.sock.gettimeout()
+    try:
+        ftp.sock.settimeout(10)
+        try:
+            ftp.voidresp()
+        finally:
+            ftp.sock.settimeout(old_timeout)
+    except all_errors:
+        pass
+
+def stream_download_transcode(ftp, item, streamable_filename, args, total_pbar=None):
+    """Pipe RETR bytes straight into ffmpeg's stdin and encode on the fly.
+
+    Skips the raw copy on disk entirely (one full write+read of the source
+    removed from the pipeline). Because the input is never probed, the speed
+    reduction uses a frame stride instead of an absolute fps filter. Returns
+    True when ffmpeg exits cleanly."""
+    stride = max(1, int(round(1.0 / args.speed)))
+    vf = f'select=not(mod(n\\,{stride}))'
+    if args.no_gpu:
+        if args.upscale:
+            vf += ',scale=1920:1080'
+        ffmpeg_cmd = [
+            'ffmpeg', '-y', '-i', 'pipe:0',
+            '-vf', vf,
+            '-c:v', 'libx265', '-preset', 'slow', '-b:v', '5M',
+            '-tag:v', 'hvc1', '-video_track_timescale', '90000', '-movflags', '+faststart',
+            streamable_filename
+        ]
+    else:
+        if args.upscale:
+            vf += ',scale_cuda=1920:1080'
+        ffmpeg_cmd = [
+            'ffmpeg', '-y', '-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda',
+            '-i', 'pipe:0',
+            '-vf', vf,
+            '-c:v', 'hevc_nvenc', '-preset', args.nvenc_preset, '-tune', nvenc_tune(args.nvenc_preset), '-b:v', '5M',
+            '-tag:v', 'hvc1', '-video_track_timescale', '90000', '-movflags', '+faststart',
+            streamable_filename
+        ]
+    proc = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE)
+    try:
+        with tqdm(total=item["size"], unit='B', unit_scale=True, desc=f"Streaming {item['name']}") as pbar:
+            conn = ftp.transfercmd(f'RETR /timelapse/{item["name"]}')
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+            buf = bytearray(1024 * 1024)
+            mv = memoryview(buf)
+            transfer_ok = False
+            try:
+                while True:
+                    n = conn.recv_into(buf)
+                    if not n:
+                        break
+                    proc.stdin.write(mv[:n])
+                    pbar.update(n)
+                    if total_pbar:
+                        total_pbar.update(n)
+                if isinstance(conn, ssl.SSLSocket):
+                    conn.unwrap()
+                transfer_ok = True
+            finally:
+                conn.close()
+                if transfer_ok:
+                    ftp.voidresp()
+                else:
+                    # ffmpeg died mid-stream (BrokenPipeError): resync the
+                    # control channel before the caller's fallback reuses it.
+                    drain_transfer_reply(ftp)
+    finally:
+        if proc.stdin:
+            proc.stdin.close()
+        proc.wait()
+    return proc.returncode == 0
+
+def drop_page_cache(path):
+    """Hint the kernel to evict a file's pages before we delete it.
+
+    The raw download and the streamable are each read exactly once, so
+    their pages only crowd out more useful cache on small SBC hosts.
+    No-op on platforms without posix_fadvise."""
+    if not hasattr(os, 'posix_fadvise'):
+        return
     try:
-        result = subprocess.run([
-            'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1', filename
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return float(result.stdout.strip())
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+def mp4_duration(path):
+    """Read an MP4/MOV duration straight from its mvhd atom.
+
+    Walks the top-level atoms for moov, then moov's children for mvhd, and
+    returns duration/timescale in seconds without spawning ffprobe. Returns
+    None when the atoms cannot be found (non-ISO containers)."""
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+
+            def find_atom(start, end, name):
+                pos = start
+                while pos + 8 <= end:
+                    f.seek(pos)
+                    header = f.read(8)
+                    if len(header) < 8:
+                        return None, None
+                    size, kind = struct.unpack('>I4s', header)
+                    body = pos + 8
+                    if size == 1:  # 64-bit atom size follows the header
+                        size = struct.unpack('>Q', f.read(8))[0]
+                        body = pos + 16
+                    if size < 8:
+                        return None, None
+                    if kind == name:
+                        return body, pos + size
+                    pos += size
+                return None, None
+
+            moov_start, moov_end = find_atom(0, file_size, b'moov')
+            if moov_start is None:
+                return None
+            mvhd_start, _ = find_atom(moov_start, moov_end, b'mvhd')
+            if mvhd_start is None:
+                return None
+            f.seek(mvhd_start)
+            version = f.read(1)[0]
+            if version == 1:
+                # version/flags + 64-bit creation/modification times
+                f.seek(mvhd_start + 4 + 16)
+                timescale, duration = struct.unpack('>IQ', f.read(12))
+            else:
+                # version/flags + 32-bit creation/modification times
+                f.seek(mvhd_start + 4 + 8)
+                timescale, duration = struct.unpack('>II', f.read(8))
+            if timescale:
+                return duration / timescale
+    except (OSError, IndexError, struct.error):
+        pass
+    return None
+
+# Persistent probe cache: the in-process lru_cache dies with the process,
+# so watch-mode restarts would re-run ffprobe on files it already saw.
+_META_DB = None
+_META_DB_LOCK = threading.Lock()
+
+def init_meta_db(out_dir):
+    """Open (or create) the sqlite probe cache next to the videos."""
+    global _META_DB
+    try:
+        db = sqlite3.connect(os.path.join(out_dir, '.meta.db'),
+                             check_same_thread=False)
+        db.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                   'name TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+                   'duration REAL, fps REAL, width INTEGER, height INTEGER, '
+                   'codec TEXT)')
+        db.commit()
+        _META_DB = db
+    except sqlite3.Error as e:
+        print(f'Could not open metadata cache: {e}')
+
+# Utility function to get video metadata using ffprobe
+def probe_video(filename):
+    """Return duration/fps/width/height/codec from a single ffprobe call.
+
+    Results are memoized by (path, mtime, size) in-process and persisted
+    to the sqlite cache so re-runs don't spawn another ffprobe for
+    unchanged files."""
+    try:
+        st = os.stat(filename)
+        name = os.path.basename(filename)
+        if _META_DB is not None:
+            try:
+                with _META_DB_LOCK:
+                    row = _META_DB.execute(
+                        'SELECT duration, fps, width, height, codec FROM metadata '
+                        'WHERE name=? AND size=? AND mtime=?',
+                        (name, st.st_size, st.st_mtime_ns)).fetchone()
+                if row:
+                    return {'duration': row[0], 'fps': row[1], 'width': row[2],
+                            'height': row[3], 'codec': row[4]}
+            except sqlite3.Error:
+                pass
+        info = _probe_cached(filename, st.st_mtime_ns, st.st_size)
+        if _META_DB is not None:
+            try:
+                with _META_DB_LOCK:
+                    _META_DB.execute(
+                        'INSERT OR REPLACE INTO metadata VALUES (?,?,?,?,?,?,?,?)',
+                        (name, st.st_size, st.st_mtime_ns, info['duration'],
+                         info['fps'], info['width'], info['height'], info['codec']))
+                    _META_DB.commit()
+            except sqlite3.Error:
+                pass
+        return info
     except Exception as e:
-        print(f"Could not determine video duration for {filename}: {e}")
-        return 999.0
+        print(f"Could not probe video {filename}: {e}")
+        # ffprobe unavailable or choked on the file: the mvhd atom still
+        # gives us the duration for the short-file gate.
+        duration = mp4_duration(filename)
+        if duration is not None:
+            print(f"Recovered duration from mvhd atom: {duration:.2f}s")
+            return {'duration': duration, 'fps': None, 'width': None, 'height': None, 'codec': None}
+        return {'duration': 999.0, 'fps': None, 'width': None, 'height': None, 'codec': None}
+
+_MTPROTO_CLIENT = None
+
+async def _get_mtproto_client():
+    """Start the Telethon client once, or return None when not configured."""
+    global _MTPROTO_CLIENT
+    if (TelegramClient is None or not config.get('telegram_api_id')
+            or not config.get('telegram_api_hash')
+            or not config.get('telegram_bot_token')):
+        return None
+    if _MTPROTO_CLIENT is None:
+        client = TelegramClient(
+            os.path.join(os.path.dirname(__file__), 'telegram_upload'),
+            int(config['telegram_api_id']), config['telegram_api_hash'])
+        await client.start(bot_token=config['telegram_bot_token'])
+        _MTPROTO_CLIENT = client
+    return _MTPROTO_CLIENT
 
-async def try_telegram_upload(config, file_path, caption=None):
-    bot_token = config.get('telegram_bot_token')
+async def try_telegram_upload(file_path, caption=None):
     channel_id = config.get('telegram_channel_id')
-    if not bot_token or not channel_id:
+    if _TG_BOT is None or not channel_id:
         print("Telegram upload skipped: Missing bot token or channel ID")
         return False
     
@@ -133,15 +621,55 @@ async def try_telegram_upload(config, file_path, caption=None):
         print(f"Error: File is empty - {file_path}")
         return False
     
-    try:
-        bot = Bot(token=bot_token)
-        with open(file_path, 'rb') as vid:
-            await bot.send_video(chat_id=channel_id, video=vid, supports_streaming=True, caption=caption)
-        print(f'Successfully uploaded to Telegram: {channel_id}')
-        return True
-    except TelegramError as e:
-        print(f'Failed to upload to Telegram: {e}')
-        return False
+    # Stay under the per-channel message cap before touching the network.
+    if len(_TG_SEND_TIMES) == _TG_SEND_TIMES.maxlen:
+        wait = 60 - (time.monotonic() - _TG_SEND_TIMES[0])
+        if wait > 0:
+            print(f'Telegram rate limit: waiting {wait:.0f}s before upload')
+            await asyncio.sleep(wait)
+    _TG_SEND_TIMES.append(time.monotonic())
+
+    async with _TG_UPLOAD_LOCK:
+        # Prefer MTProto when configured: 512KB parts straight to the data
+        # center instead of one HTTPS POST through the Bot API front-end.
+        try:
+            client = await _get_mtproto_client()
+        except Exception as e:
+            print(f'MTProto client unavailable: {e}')
+            client = None
+        if client is not None:
+            try:
+                # send_file silently drops unknown kwargs, so the part size
+                # must be set on the explicit upload_file call.
+                handle = await client.upload_file(file_path, part_size_kb=512)
+                await client.send_file(channel_id, handle, caption=caption,
+                                       supports_streaming=True)
+                print(f'Successfully uploaded via MTProto: {channel_id}')
+                return True
+            except Exception as e:
+                print(f'MTProto upload failed ({e}); falling back to Bot API')
+
+        for attempt in range(5):
+            try:
+                # read_file_handle=False streams the multipart body from disk
+                # instead of loading the whole mp4 into memory first.
+                with open(file_path, 'rb') as vid:
+                    video = InputFile(vid, filename=os.path.basename(file_path), read_file_handle=False)
+                    await _TG_BOT.send_video(chat_id=channel_id, video=video, supports_streaming=True, caption=caption)
+                print(f'Successfully uploaded to Telegram: {channel_id}')
+                return True
+            except RetryAfter as e:
+                # Flood control tells us exactly how long to wait.
+                print(f'Telegram flood control: retrying in {e.retry_after + 1}s')
+                await asyncio.sleep(e.retry_after + 1)
+            except NetworkError as e:
+                print(f'Telegram network error ({e}); retrying in {2 ** attempt}s')
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                print(f'Failed to upload to Telegram: {e}')
+                return False
+    print(f'Giving up on Telegram upload after 5 attempts: {file_path}')
+    return False
 
 def main():
     parser = argparse.ArgumentParser(description="Download timelapse videos via FTP.")
@@ -156,10 +684,23 @@ def main():
     parser.add_argument('--upscale', action='store_true', help='Upscale to 1080p when creating streamable file (uses GPU if available). Off by default.')
     parser.add_argument('--keep-after-upload', action='store_true', help='Keep streamable file after Telegram upload (default: delete after upload)')
     parser.add_argument('--no-gpu', action='store_true', help='Force CPU-only processing (no NVIDIA GPU required)')
+    parser.add_argument('--nvenc-preset', default='p5', choices=['p1', 'p2', 'p3', 'p4', 'p5', 'p6', 'p7'], help='NVENC preset for GPU encodes; p5 is ~2x faster than p7 at near-equal quality (default: p5)')
+    parser.add_argument('--pipe-transcode', action='store_true', help='Stream FTP downloads directly into ffmpeg without writing the original file to disk (skips the raw local copy)')
     parser.add_argument('--speed', type=float, default=0.3, help='Adjust video speed (e.g., 0.5 for half speed, 2.0 for double speed). Default is 0.3 (slower speed).')
     parser.add_argument('--test', action='store_true', help='Run test mode: process and upload test_video.avi')
     args = parser.parse_args()
 
+    if not args.no_gpu and not HAVE_NVENC:
+        print('hevc_nvenc not available in this ffmpeg build; falling back to CPU (libx265)')
+        args.no_gpu = True
+
+    # One event loop for the whole process. The Bot's httpx pool and the
+    # MTProto client bind to the loop they first run on, so every entry
+    # point (test mode, watch, single run) must share this one instead of
+    # getting a throwaway loop from asyncio.run.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
     # Test mode implementation
     if args.test:
         # Specific test video file
@@ -179,16 +720,13 @@ def main():
         # Process video
         streamable_filename = os.path.splitext(test_video)[0] + '_streamable.mp4'
         
-        # Calculate original FPS
-        original_fps = float(subprocess.check_output([
-            'ffprobe', '-v', 'error', 
-            '-select_streams', 'v:0', 
-            '-count_packets', 
-            '-show_entries', 'stream=r_frame_rate', 
-            '-of', 'csv=p=0', 
-            test_video
-        ], text=True).strip().split('/')[0])
-        
+        # Calculate original FPS (single ffprobe call for all metadata)
+        test_probe = probe_video(test_video)
+        original_fps = test_probe['fps']
+        if original_fps is None:
+            print(f'Could not determine frame rate for {test_video}')
+            sys.exit(1)
+
         # Adjust frame selection to maintain video quality while reducing frame count
         target_fps = max(1, original_fps * args.speed)
         
@@ -197,30 +735,37 @@ def main():
                 'ffmpeg', '-y', '-i', test_video,
                 '-vf', f'fps={target_fps},scale=1920:1080',
                 '-c:v', 'libx265', '-preset', 'slow', '-b:v', '5M',
-                '-tag:v', 'hvc1', '-video_track_timescale', '90000',
+                '-tag:v', 'hvc1', '-video_track_timescale', '90000', '-movflags', '+faststart',
                 streamable_filename
             ]
         else:
+            # Keep decoded surfaces in VRAM (NVDEC -> NVENC) instead of bouncing
+            # every frame through system RAM, and decimate with an integer
+            # stride so skipped frames are never processed downstream.
+            stride = max(1, int(round(1.0 / args.speed)))
             ffmpeg_cmd = [
-                'ffmpeg', '-y', '-hwaccel', 'cuda', '-i', test_video,
-                '-vf', f'fps={target_fps}',
-                '-c:v', 'hevc_nvenc', '-preset', 'p7', '-tune', 'hq', '-b:v', '5M',
-                '-tag:v', 'hvc1', '-video_track_timescale', '90000',
+                'ffmpeg', '-y', '-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda',
+                '-i', test_video,
+                '-vf', f'select=not(mod(n\\,{stride}))',
+                '-c:v', 'hevc_nvenc', '-preset', args.nvenc_preset, '-tune', nvenc_tune(args.nvenc_preset), '-b:v', '5M',
+                '-tag:v', 'hvc1', '-video_track_timescale', '90000', '-movflags', '+faststart',
                 streamable_filename
             ]
         
         try:
-            subprocess.run(ffmpeg_cmd, check=True)
+            if args.no_gpu or not transcode_nvc(test_video, streamable_filename, target_fps, original_fps, args.nvenc_preset):
+                run_ffmpeg(ffmpeg_cmd, test_probe['duration'])
             print(f'Created streamable video at {streamable_filename} (speed: {args.speed}x)')
             
             # Attempt Telegram upload
             caption = f'Test Video: {os.path.basename(test_video)} (Speed: {args.speed}x)'
-            tg_success = asyncio.run(try_telegram_upload(config, streamable_filename, caption=caption))
-            
+            tg_success = loop.run_until_complete(try_telegram_upload(streamable_filename, caption=caption))
+
             # Clean up
             if os.path.exists(streamable_filename):
                 os.remove(streamable_filename)
-            
+
+            loop.close()
             sys.exit(0 if tg_success else 1)
         
         except subprocess.CalledProcessError as e:
@@ -229,17 +774,12 @@ def main():
 
     out_dir = args.out
     os.makedirs(out_dir, exist_ok=True)
+    init_meta_db(out_dir)
 
-    async def download_and_process():
-        ftp = None
+    async def download_and_process(session):
         try:
-            ftp = ImplicitFTP_TLS()
-            ftp.set_pasv(True)
-            print('Connecting...')
             try:
-                ftp.connect(host=PRINTER_IP, port=990, timeout=15, source_address=None)
-                ftp.login('bblp', ACCESS_CODE)
-                ftp.prot_p()
+                ftp = session.get()
             except OSError as e:
                 print(f"Network error during FTP connection: {e}")
                 return False
@@ -247,22 +787,21 @@ def main():
                 print(f"FTP error during connection: {ex}")
                 return False
 
-            tldirlist = []
-            tltndirlist = []
             try:
-                ftp.cwd('/timelapse')
-                ftp.retrlines('LIST', tldirlist.append)
-                tldirlist = [parse_ftp_listing(line) for line in tldirlist if parse_ftp_listing(line)]
-                ftp.cwd('/timelapse/thumbnail')
-                ftp.retrlines('LIST', tltndirlist.append)
-                tltndirlist = [parse_ftp_listing(line) for line in tltndirlist if parse_ftp_listing(line)]
+                tldirlist = list_directory(ftp, '/timelapse')
+                tltndirlist = list_directory(ftp, '/timelapse/thumbnail')
             except all_errors as ex:
                 print(f"FTP error during directory listing: {ex}")
                 return False
 
             tldirlist_dict = {get_base_name(item['name']): item for item in tldirlist}
             tltndirlist_set = {get_base_name(item['name']) for item in tltndirlist}
-            matching_files = [tldirlist_dict[base_name] for base_name in tldirlist_dict if base_name in tltndirlist_set]
+            # Base name -> full thumbnail name, so per-file deletion is a dict
+            # lookup instead of a scan over the whole thumbnail listing.
+            tltndirlist_by_base = {get_base_name(item['name']): item['name'] for item in tltndirlist}
+            # Set intersection runs in C over the smaller side instead of
+            # hashing every video key against the thumbnail set.
+            matching_files = [tldirlist_dict[base_name] for base_name in tldirlist_dict.keys() & tltndirlist_set]
 
             if not matching_files:
                 print('No matching files found.')
@@ -277,122 +816,308 @@ def main():
             else:
                 total_pbar = None
 
-            for item in files_to_download:
+            # With --all, run the transfers concurrently on separate data
+            # connections; the listing stays on the implicit-FTPS control
+            # connection since aioftp has no implicit-TLS listing support.
+            prefetched = set()
+            if args.all and len(files_to_download) > 1 and aioftp is not None:
+                sem = asyncio.Semaphore(3)
+                results = await asyncio.gather(
+                    *(fetch_one(item, out_dir, sem, total_pbar) for item in files_to_download),
+                    return_exceptions=True)
+                for dl_item, result in zip(files_to_download, results):
+                    if result is True:
+                        prefetched.add(dl_item["name"])
+                    else:
+                        print(f'Parallel download failed for {dl_item["name"]}: {result}')
+
+            # Pipeline the per-file stages so the FTP download of item N+1
+            # overlaps the GPU-bound transcode of item N and the network-bound
+            # upload of item N-1. One worker per stage keeps the control
+            # connection and the GPU single-tenant; the bounded queues stop
+            # the downloader from racing ahead of the encoder.
+            loop = asyncio.get_running_loop()
+            transcode_queue = asyncio.Queue(2)
+            upload_queue = asyncio.Queue(2)
+            # Remote DELEs are each a full control-channel round-trip; queue
+            # them and let a background task drain the queue while the
+            # transcode runs instead of paying the RTT between stages.
+            delete_queue = asyncio.Queue()
+            # One control connection is shared between downloads and deletes;
+            # the lock keeps their commands from interleaving.
+            ftp_lock = asyncio.Lock()
+
+            def download_one(item):
+                """Stage 1 (FTP-bound): fetch one file and handle remote deletion.
+
+                Returns a work dict for the transcode stage, or None when the
+                file failed to download or was skipped as too short."""
                 print(f'Processing: {item["name"]}')
                 should_delete_remote_file = True
                 local_filename = os.path.join(out_dir, item["name"])
                 file_size = item["size"]
-                try:
-                    with open(local_filename, 'wb') as f:
-                        with tqdm(total=file_size, unit='B', unit_scale=True, desc=f"Downloading {item['name']}") as pbar:
-                            def callback(data):
-                                f.write(data)
-                                pbar.update(len(data))
-                                if total_pbar:
-                                    total_pbar.update(len(data))
-                            try:
-                                ftp.retrbinary(f'RETR /timelapse/{item["name"]}', callback)
-                            except all_errors as ex:
-                                print(f"FTP error during file download: {ex}")
-                                continue
+                streamable_filename = None
+
+                # --pipe-transcode feeds the RETR stream straight into ffmpeg,
+                # so the raw download never touches disk.
+                piped = False
+                if (args.pipe_transcode and not args.no_make_streamable
+                        and item["name"] not in prefetched):
+                    streamable_filename = os.path.splitext(local_filename)[0] + '_streamable.mp4'
+                    try:
+                        piped = stream_download_transcode(ftp, item, streamable_filename, args, total_pbar)
+                    except all_errors as ex:
+                        print(f"FTP error during streamed transcode: {ex}")
+                    except Exception as e:
+                        print(f"Error during streamed transcode: {e}")
+                    if not piped:
+                        print('Streamed transcode failed; falling back to download + transcode')
+                        streamable_filename = None
+
+                if piped:
+                    print(f'Streamable file created: {streamable_filename}')
+                elif item["name"] in prefetched:
                     print(f'File downloaded: {local_filename}')
-                except Exception as e:
-                    print(f"Error writing file {local_filename}: {e}")
-                    continue
+                else:
+                    try:
+                        # 1 MiB write buffering keeps the local writes aligned
+                        # with the 1 MiB network reads below.
+                        with open(local_filename, 'wb', buffering=1 << 20) as f:
+                            if hasattr(os, 'posix_fadvise'):
+                                # Sequential write now, one sequential ffmpeg
+                                # read later: tell the page cache as much.
+                                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                            with tqdm(total=file_size, unit='B', unit_scale=True, desc=f"Downloading {item['name']}") as pbar:
+                                try:
+                                    # Read straight into a preallocated 1 MiB buffer
+                                    # instead of retrbinary's per-8KB-block callback.
+                                    conn = ftp.transfercmd(f'RETR /timelapse/{item["name"]}')
+                                    # Widen the receive window for high-BDP links.
+                                    conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+                                    # Decouple socket reads from disk writes: the
+                                    # network loop only enqueues chunks while a
+                                    # writer thread drains them to disk, so recv
+                                    # and write overlap (both release the GIL).
+                                    chunk_q = queue.Queue(maxsize=8)
+                                    write_errors = []
+
+                                    def writer():
+                                        # On a write error (e.g. disk full) keep
+                                        # draining the queue so the recv loop's
+                                        # put() never blocks forever; the error
+                                        # is re-raised after join().
+                                        while True:
+                                            b = chunk_q.get()
+                                            if b is None:
+                                                break
+                                            if write_errors:
+                                                continue
+                                            try:
+                                                f.write(b)
+                                                pbar.update(len(b))
+                                                if total_pbar:
+                                                    total_pbar.update(len(b))
+                                            except Exception as e:
+                                                write_errors.append(e)
+
+                                    writer_thread = threading.Thread(target=writer)
+                                    writer_thread.start()
+                                    buf = bytearray(1024 * 1024)
+                                    mv = memoryview(buf)
+                                    transfer_ok = False
+                                    try:
+                                        while True:
+                                            n = conn.recv_into(buf)
+                                            if not n:
+                                                break
+                                            # recv_into reuses buf, so hand the
+                                            # writer its own copy.
+                                            chunk_q.put(bytes(mv[:n]))
+                                        if isinstance(conn, ssl.SSLSocket):
+                                            conn.unwrap()
+                                        transfer_ok = True
+                                    finally:
+                                        chunk_q.put(None)
+                                        writer_thread.join()
+                                        conn.close()
+                                        if transfer_ok:
+                                            ftp.voidresp()
+                                        else:
+                                            drain_transfer_reply(ftp)
+                                    if write_errors:
+                                        raise write_errors[0]
+                                except all_errors as ex:
+                                    print(f"FTP error during file download: {ex}")
+                                    return None
+                        print(f'File downloaded: {local_filename}')
+                    except Exception as e:
+                        print(f"Error writing file {local_filename}: {e}")
+                        return None
 
                 # Check video duration before any processing
                 try:
-                    duration = get_video_duration(local_filename)
+                    if piped:
+                        probe = probe_video(streamable_filename)
+                        duration = probe['duration']
+                    else:
+                        probe = probe_video(local_filename)
+                        duration = probe['duration']
+                    original_fps = probe['fps']
                 except Exception as e:
                     print(f"Error getting video duration: {e}")
+                    probe = {}
                     duration = 0
+                    original_fps = None
 
                 if duration < 1.0:
                     print(f"Skipping processing: {local_filename} is too short ({duration:.2f}s)")
                     print(f'Local file retained: {local_filename}')
                     should_delete_remote_file = True
-                    upload_filename = None
                     short_file_skipped = True
                 else:
                     short_file_skipped = False
 
                 video_file_ftp_path = f'/timelapse/{item["name"]}'
-                
+
                 # Delete remote files by default; use --do-not-delete to prevent deletion.
                 if args.do_not_delete:
-                    deleted_video_successfully = False
                     should_delete_remote_file = False
-                    
-                # Attempt to delete remote file if conditions are met
-                if should_delete_remote_file:
-                    try:
-                        ftp.delete(video_file_ftp_path)
-                        print(f'Remote file deleted: {video_file_ftp_path}')
-                        deleted_video_successfully = True
-                    except all_errors as e:
-                        print(f'Failed to delete remote file {video_file_ftp_path}: {e}\n')
-                        deleted_video_successfully = False
-                else:
-                    print(f'Remote file retained: {video_file_ftp_path}')
-                    deleted_video_successfully = False
 
-                if deleted_video_successfully:
+                # Queue remote deletions for the background deleter task.
+                # download_one runs in an executor thread, so hand the paths
+                # to the event loop with call_soon_threadsafe.
+                if should_delete_remote_file:
+                    loop.call_soon_threadsafe(delete_queue.put_nowait, video_file_ftp_path)
                     video_base_name = get_base_name(item['name'])
-                    thumbnail_to_delete_full_name = None
-                    for tn_item_detail in tltndirlist:
-                        if get_base_name(tn_item_detail['name']) == video_base_name:
-                            thumbnail_to_delete_full_name = tn_item_detail['name']
-                            break
-                    
+                    thumbnail_to_delete_full_name = tltndirlist_by_base.get(video_base_name)
+
                     if thumbnail_to_delete_full_name:
                         thumbnail_ftp_path = f'/timelapse/thumbnail/{thumbnail_to_delete_full_name}'
-                        try:
-                            ftp.delete(thumbnail_ftp_path)
-                            print(f'Remote thumbnail deleted: {thumbnail_ftp_path}\n')
-                        except all_errors as e:
-                            print(f'Failed to delete remote thumbnail {thumbnail_ftp_path}: {e}\n')
+                        loop.call_soon_threadsafe(delete_queue.put_nowait, thumbnail_ftp_path)
                     else:
                         print(f'No corresponding remote thumbnail found for base name {video_base_name} to delete.\n')
+                else:
+                    print(f'Remote file retained: {video_file_ftp_path}')
 
                 if short_file_skipped:
-                    continue
+                    return None
 
-                streamable_filename = None
+                return {
+                    'item': item,
+                    'local_filename': local_filename,
+                    'streamable_filename': streamable_filename,
+                    'piped': piped,
+                    'probe': probe,
+                    'original_fps': original_fps,
+                }
+
+            def make_streamable(work):
+                """Stage 2 (GPU-bound): produce the streamable mp4 for one item."""
+                local_filename = work['local_filename']
+                streamable_filename = work['streamable_filename']
+                original_fps = work['original_fps']
                 upload_filename = local_filename  # Default to original file
+                max_telegram_size = 49 * 1024 * 1024  # 49 MB
 
-                if not args.no_make_streamable:
+                if work['piped']:
+                    file_size = os.path.getsize(streamable_filename)
+                    if file_size > max_telegram_size:
+                        print(f'WARNING: Streamable file {streamable_filename} ({file_size / (1024*1024):.2f}MB) is too large for Telegram (limit ~49MB).')
+                        print(f'Skipping upload for this file. {streamable_filename} will be kept for manual handling.')
+                        streamable_filename = None
+                        upload_filename = None
+                    else:
+                        upload_filename = streamable_filename
+                elif not args.no_make_streamable:
                     scale_filter = ',scale=1920:1080' if args.upscale else ''
                     streamable_filename = os.path.splitext(local_filename)[0] + '_streamable.mp4'
                     try:
-                        original_fps = float(subprocess.check_output([
-                            'ffprobe', '-v', 'error',
-                            '-select_streams', 'v:0',
-                            '-count_packets',
-                            '-show_entries', 'stream=r_frame_rate',
-                            '-of', 'csv=p=0',
-                            local_filename
-                        ], text=True).strip().split('/')[0])
-                        target_fps = max(1, original_fps * args.speed)
-                        if args.no_gpu:
-                            ffmpeg_cmd = [
+                        source = work['probe']
+                        if (args.speed == 1.0 and source.get('codec') in ('h264', 'hevc')
+                                and 0 < (source.get('width') or 0) <= 1920
+                                and 0 < (source.get('height') or 0) <= 1080
+                                and (not args.upscale or source.get('width') == 1920)
+                                # A copy is the same size as the source, so it
+                                # must already fit under the Telegram cap —
+                                # otherwise re-encoding at the bounded bitrate
+                                # is the only way to get an uploadable file.
+                                and os.path.getsize(local_filename) <= max_telegram_size):
+                            # Already H.264/HEVC within the 1080p budget and no
+                            # speed change: a container rewrite is all we need.
+                            tag = ['-tag:v', 'hvc1'] if source.get('codec') == 'hevc' else []
+                            print(f'Source already streamable-compatible; stream-copying: {streamable_filename}')
+                            run_ffmpeg([
                                 'ffmpeg', '-y', '-i', local_filename,
-                                '-vf', f'fps={target_fps}{scale_filter}',
-                                '-c:v', 'libx265', '-preset', 'slow', '-b:v', '5M',
-                                '-tag:v', 'hvc1', '-video_track_timescale', '90000',
+                                '-c', 'copy',
+                            ] + tag + [
+                                '-movflags', '+faststart',
                                 streamable_filename
-                            ]
+                            ], source.get('duration'))
+                        elif original_fps is None:
+                            raise ValueError(f'could not determine frame rate for {local_filename}')
                         else:
-                            ffmpeg_cmd = [
-                                'ffmpeg', '-y', '-hwaccel', 'cuda', '-i', local_filename,
-                                '-vf', f'fps={target_fps}{scale_filter}',
-                                '-c:v', 'hevc_nvenc', '-preset', 'p7', '-tune', 'hq', '-b:v', '5M',
-                                '-tag:v', 'hvc1', '-video_track_timescale', '90000',
-                                streamable_filename
-                            ]
-                        print(f'Running ffmpeg to create streamable: {streamable_filename}')
-                        subprocess.run(ffmpeg_cmd, check=True)
+                            target_fps = max(1, original_fps * args.speed)
+                            # Bound the bitrate by the output duration so the
+                            # file is guaranteed under Telegram's ~49MB cap
+                            # instead of discovering an oversized file after a
+                            # full encode pass. Every encode path (fps= on CPU,
+                            # stride select on GPU, PyNvVideoCodec) preserves
+                            # the source duration.
+                            target_duration = source.get('duration') or 0
+                            if target_duration > 0:
+                                target_bitrate = min(5_000_000, int(49 * 1024 * 1024 * 8 / target_duration * 0.9))
+                            else:
+                                target_bitrate = 5_000_000
+                            burst = str(int(target_bitrate * 1.5))
+                            if args.no_gpu:
+                                ffmpeg_cmd = [
+                                    'ffmpeg', '-y', '-i', local_filename,
+                                    '-vf', f'fps={target_fps}{scale_filter}',
+                                    '-c:v', 'libx265', '-preset', 'slow',
+                                    '-b:v', str(target_bitrate), '-maxrate', burst, '-bufsize', burst,
+                                    '-tag:v', 'hvc1', '-video_track_timescale', '90000', '-movflags', '+faststart',
+                                    streamable_filename
+                                ]
+                            else:
+                                # Full-GPU pipeline: drop frames with an integer stride
+                                # (select passes hw frames through untouched, keeping
+                                # their timestamps so the duration matches the CPU
+                                # fps= path) and scale with scale_cuda so frames
+                                # never leave VRAM.
+                                stride = max(1, int(round(1.0 / args.speed)))
+                                gpu_vf = f'select=not(mod(n\\,{stride}))'
+                                if args.upscale:
+                                    gpu_vf += ',scale_cuda=1920:1080'
+                                ffmpeg_cmd = [
+                                    'ffmpeg', '-y', '-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda',
+                                    '-i', local_filename,
+                                    '-vf', gpu_vf,
+                                    '-c:v', 'hevc_nvenc', '-preset', args.nvenc_preset, '-tune', nvenc_tune(args.nvenc_preset),
+                                    '-b:v', str(target_bitrate), '-maxrate', burst, '-bufsize', burst,
+                                    '-tag:v', 'hvc1', '-video_track_timescale', '90000', '-movflags', '+faststart',
+                                    streamable_filename
+                                ]
+                            # transcode_nvc has no scaling step, so --upscale
+                            # must go through ffmpeg's scale_cuda path.
+                            if args.no_gpu or args.upscale or not transcode_nvc(local_filename, streamable_filename, target_fps, original_fps, args.nvenc_preset, target_bitrate):
+                                print(f'Running ffmpeg to create streamable: {streamable_filename}')
+                                try:
+                                    run_ffmpeg(ffmpeg_cmd, target_duration)
+                                except subprocess.CalledProcessError:
+                                    if args.no_gpu:
+                                        raise
+                                    # NVENC was reported available but the encode
+                                    # still failed; retry once on the CPU.
+                                    print('NVENC encode failed; retrying with libx265')
+                                    run_ffmpeg([
+                                        'ffmpeg', '-y', '-i', local_filename,
+                                        '-vf', f'fps={target_fps}{scale_filter}',
+                                        '-c:v', 'libx265', '-preset', 'slow',
+                                        '-b:v', str(target_bitrate), '-maxrate', burst, '-bufsize', burst,
+                                        '-tag:v', 'hvc1', '-video_track_timescale', '90000', '-movflags', '+faststart',
+                                        streamable_filename
+                                    ], target_duration)
                         print(f'Streamable file created: {streamable_filename}')
-                        max_telegram_size = 49 * 1024 * 1024  # 49 MB
                         file_size = os.path.getsize(streamable_filename)
                         if file_size > max_telegram_size:
                             print(f'WARNING: Streamable file {streamable_filename} ({file_size / (1024*1024):.2f}MB) is too large for Telegram (limit ~49MB).')
@@ -407,26 +1132,117 @@ def main():
                         print(f'Unexpected error during streamable creation: {e}')
                         streamable_filename = None
 
-                # Attempt Telegram upload
-                if upload_filename:
-                    caption = extract_datetime_from_filename(os.path.basename(local_filename))
+                work['streamable_filename'] = streamable_filename
+                work['upload_filename'] = upload_filename
+                return work
+
+            async def upload_one(work):
+                """Stage 3 (network-bound): upload to Telegram and clean up."""
+                local_filename = work['local_filename']
+                streamable_filename = work['streamable_filename']
+                upload_filename = work['upload_filename']
+                if not upload_filename:
+                    return
+                caption = extract_datetime_from_filename(os.path.basename(local_filename))
+                try:
+                    upload_success = await try_telegram_upload(upload_filename, caption=caption)
+                except Exception as e:
+                    print(f"Error during Telegram upload: {e}")
+                    upload_success = False
+
+                # Clean up files after successful upload
+                if upload_success:
+                    if not args.keep_after_upload:
+                        try:
+                            if streamable_filename and os.path.exists(streamable_filename):
+                                drop_page_cache(streamable_filename)
+                                os.remove(streamable_filename)
+                            if os.path.exists(local_filename):
+                                drop_page_cache(local_filename)
+                                os.remove(local_filename)
+                        except Exception as e:
+                            print(f"Error during cleanup: {e}")
+                    print(f'Uploaded and cleaned up: {upload_filename}')
+
+            def pipeline_deletes(paths):
+                """Send all DELEs back-to-back, then drain the responses.
+
+                A batch of N deletions costs one round-trip plus N response
+                lines instead of N full round-trips."""
+                for path in paths:
+                    ftp.putcmd(f'DELE {path}')
+                results = []
+                for path in paths:
                     try:
-                        upload_success = await try_telegram_upload(config, upload_filename, caption=caption)
-                    except Exception as e:
-                        print(f"Error during Telegram upload: {e}")
-                        upload_success = False
-                    
-                    # Clean up files after successful upload
-                    if upload_success:
-                        if not args.keep_after_upload:
-                            try:
-                                if streamable_filename and os.path.exists(streamable_filename):
-                                    os.remove(streamable_filename)
-                                if os.path.exists(local_filename):
-                                    os.remove(local_filename)
-                            except Exception as e:
-                                print(f"Error during cleanup: {e}")
-                        print(f'Uploaded and cleaned up: {upload_filename}')
+                        ftp.getresp()
+                        results.append((path, None))
+                    except all_errors as e:
+                        results.append((path, e))
+                return results
+
+            async def deleter():
+                """Background stage: drain queued remote DELEs while the
+                transcode runs, sharing the control connection under ftp_lock."""
+                while True:
+                    paths = [await delete_queue.get()]
+                    while not delete_queue.empty():
+                        paths.append(delete_queue.get_nowait())
+                    try:
+                        async with ftp_lock:
+                            results = await loop.run_in_executor(None, pipeline_deletes, paths)
+                        for path, err in results:
+                            if err is None:
+                                print(f'Remote file deleted: {path}')
+                            else:
+                                print(f'Failed to delete remote file {path}: {err}\n')
+                    except all_errors as e:
+                        print(f'Failed to delete remote files {paths}: {e}\n')
+                    finally:
+                        for _ in paths:
+                            delete_queue.task_done()
+
+            async def downloader():
+                for item in files_to_download:
+                    async with ftp_lock:
+                        work = await loop.run_in_executor(None, download_one, item)
+                    if work is not None:
+                        await transcode_queue.put(work)
+                await transcode_queue.put(None)
+
+            async def transcoder():
+                while True:
+                    work = await transcode_queue.get()
+                    if work is None:
+                        await upload_queue.put(None)
+                        break
+                    work = await loop.run_in_executor(None, make_streamable, work)
+                    await upload_queue.put(work)
+
+            async def uploader():
+                while True:
+                    work = await upload_queue.get()
+                    if work is None:
+                        break
+                    await upload_one(work)
+
+            deleter_task = asyncio.create_task(deleter())
+            stage_tasks = [asyncio.create_task(worker())
+                           for worker in (downloader, transcoder, uploader)]
+            try:
+                await asyncio.gather(*stage_tasks)
+                # Make sure every queued DELE has been answered before
+                # tearing down; the deleter itself runs forever, so cancel
+                # it once drained.
+                await delete_queue.join()
+            finally:
+                # On any stage failure the surviving workers and the deleter
+                # would otherwise be left pending (leaking one set of tasks
+                # per failing watch iteration); cancel and reap them all.
+                for task in stage_tasks:
+                    task.cancel()
+                deleter_task.cancel()
+                await asyncio.gather(*stage_tasks, deleter_task,
+                                     return_exceptions=True)
 
             if total_pbar:
                 total_pbar.close()
@@ -434,38 +1250,37 @@ def main():
         except Exception as ex:
             print(f"General error in download_and_process: {ex}")
             return False
-        finally:
-            if ftp is not None:
-                try:
-                    if ftp.sock:
-                        ftp.quit()
-                        print('Disconnected. Enjoy =D')
-                    else:
-                        print('FTP connection was not fully established or already closed.')
-                except all_errors as e:
-                    print(f'Error during FTP quit/close: {e}. Connection might have already been terminated.')
-                except Exception as e:
-                    print(f'Unexpected error during FTP quit/close: {e}')
-                if hasattr(ftp, '_sock') and ftp._sock is not None:
-                    try:
-                        ftp.close()
-                    except all_errors:
-                        pass
-                    except Exception:
-                        pass
         return True
 
+    session = FTPSession(PRINTER_IP, 'bblp', ACCESS_CODE)
     if args.watch:
         print('Entering watch mode. Checking for new files every 60 seconds...')
-        while True:
-            processed_files = asyncio.run(download_and_process())
-            if not processed_files:
-                time.sleep(60)
+
+        async def watch_loop():
+            # One event loop for the whole watch session; the FTPS connection
+            # is kept alive by the shared FTPSession between iterations.
+            while True:
+                processed_files = await download_and_process(session)
+                if not processed_files:
+                    await asyncio.sleep(60)
+
+        try:
+            loop.run_until_complete(watch_loop())
+        except KeyboardInterrupt:
+            print('Shutting down...')
+        finally:
+            session.close()
+            loop.close()
+            print('Disconnected. Enjoy =D')
     else:
         try:
-            asyncio.run(download_and_process())
+            loop.run_until_complete(download_and_process(session))
         except Exception as e:
             print(f"Error occurred: {e}")
+        finally:
+            session.close()
+            loop.close()
+            print('Disconnected. Enjoy =D')
 
 if __name__ == "__main__":
     main()
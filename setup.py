@@ -0,0 +1,15 @@
+from setuptools import setup
+
+# Compile the hot LIST-parsing helpers with mypyc when it is available;
+# the pure-Python module is used unchanged otherwise.
+try:
+    from mypyc.build import mypycify
+    ext_modules = mypycify(['_listing.py'])
+except ImportError:
+    ext_modules = []
+
+setup(
+    name='timelapse-downloader',
+    py_modules=['get_timelapse', '_listing'],
+    ext_modules=ext_modules,
+)